@@ -1,3 +1,4 @@
+import time
 import asyncio
 import platform
 
@@ -5,6 +6,8 @@ from typing import Literal
 
 from pydantic import BaseModel, Field
 
+from playwright.async_api import Locator, Page
+
 from langchain_core.tools import tool
 
 from state import AgentState
@@ -78,7 +81,13 @@ class TypeInputSchema(BaseModel):
     bbox_label: str = Field(
         ..., description="Numerical label of the element to type into"
     )
-    text: str = Field(..., description="Text to be typed")
+    text: str = Field(
+        ...,
+        description="Text to be typed, or the option to be chosen if the element is a select",
+    )
+    submit: bool = Field(
+        False, description="Whether to press Enter after typing to submit the text"
+    )
 
 
 #
@@ -92,6 +101,101 @@ def type_tool(input: TypeInputSchema):
     pass
 
 
+#
+# Define input strategies for the type node
+#
+
+# Input types which value can be filled directly
+FILLABLE_INPUT_TYPES = [
+    "",
+    "text",
+    "search",
+    "email",
+    "url",
+    "tel",
+    "password",
+    "number",
+]
+
+
+# Milliseconds to wait for the element to accept the value directly before falling back to the key events
+FILL_TIMEOUT = 2000
+
+
+async def get_input_strategy(element: Locator) -> str:
+    """Choose how to enter text into the element: "select", "fill", "keyboard" or "disabled" """
+    tag, input_type, editable, read_only, disabled = await element.evaluate(
+        """(el) => [
+            el.tagName.toLowerCase(),
+            (el.getAttribute("type") || "").toLowerCase(),
+            el.isContentEditable,
+            Boolean(el.readOnly),
+            Boolean(el.disabled) || el.getAttribute("aria-disabled") === "true",
+        ]"""
+    )
+
+    if disabled:
+        return "disabled"
+
+    if tag == "select":
+        return "select"
+
+    # Read only fields are usually custom widgets (e.g. date pickers) handling the key events themselves
+    if read_only:
+        return "keyboard"
+
+    if tag == "textarea" or editable:
+        return "fill"
+
+    if tag == "input" and input_type in FILLABLE_INPUT_TYPES:
+        return "fill"
+
+    # Custom widgets (e.g. comboboxes built on divs) only react on key events
+    return "keyboard"
+
+
+async def select_option(element: Locator, text: str) -> bool:
+    """Select the option matching the text by its label or value, returns False if there is no such option"""
+    return await element.evaluate(
+        """(el, text) => {
+            const option = [...el.options].find(
+                (option) =>
+                    option.label.trim() === text.trim() ||
+                    option.text.trim() === text.trim() ||
+                    option.value === text
+            );
+
+            if (!option) {
+                return false;
+            }
+
+            el.value = option.value;
+            el.dispatchEvent(new Event("input", { bubbles: true }));
+            el.dispatchEvent(new Event("change", { bubbles: true }));
+
+            return true;
+        }""",
+        text,
+    )
+
+
+async def fill(element: Locator, text: str):
+    # Fill triggers the input event, frameworks listening to change need it dispatched as well
+    await element.fill(text, timeout=FILL_TIMEOUT)
+    await element.dispatch_event("change", timeout=FILL_TIMEOUT)
+
+
+async def type_with_keyboard(page: Page, element: Locator, text: str):
+    await element.click()
+
+    # Check if MacOS
+    select_all = "Meta+A" if platform.system() == "Darwin" else "Control+A"
+
+    await page.keyboard.press(select_all)
+    await page.keyboard.press("Backspace")
+    await page.keyboard.type(text)
+
+
 #
 # Define type node
 #
@@ -115,20 +219,39 @@ async def type_node(state: AgentState):
         reason = args["reason"]
         text = args["text"]
         bbox_label = args["bbox_label"]
+        submit = args.get("submit") or False
 
-        await page.click(f"[data-interactive-index='{bbox_label}']")
+        started_at = time.perf_counter()
+
+        element = page.locator(f"[data-interactive-index='{bbox_label}']")
+        strategy = await get_input_strategy(element)
+
+        if strategy == "disabled":
+            observation = f"Failed to type in element {bbox_label} because it is disabled"
+        elif strategy == "select" and not await select_option(element, text):
+            observation = f'Failed to select "{text}" in the element {bbox_label} because there is no such option'
+        else:
+            if strategy == "fill":
+                try:
+                    await fill(element, text)
+                except Exception:
+                    # Fall back to the key events if the element doesn't accept the value directly
+                    strategy = "keyboard"
+
+            if strategy == "keyboard":
+                await type_with_keyboard(page, element, text)
 
-        # Check if MacOS
-        select_all = "Meta+A" if platform.system() == "Darwin" else "Control+A"
+            if submit:
+                await element.press("Enter")
 
-        await page.keyboard.press(select_all)
-        await page.keyboard.press("Backspace")
-        await page.keyboard.type(text)
-        await page.keyboard.press("Enter")
+            duration = time.perf_counter() - started_at
 
-        observation = (
-            f'Typed "{text}" in the element {bbox_label} for the reason "{reason}"'
-        )
+            verb = "Selected" if strategy == "select" else "Typed"
+
+            observation = (
+                f'{verb} "{text}" in the element {bbox_label}{" and submitted it" if submit else ""} '
+                f'using {strategy} input in {duration:.2f}s for the reason "{reason}"'
+            )
 
     return {
         **state,
@@ -0,0 +1,68 @@
+import os
+
+from typing import Optional, Tuple
+
+from pydantic import BaseModel, ConfigDict, Field
+
+#
+# Configuration of the agent graph
+#
+
+
+def get_browser_workers() -> Tuple[str, ...]:
+    """Endpoints of the browser workers from BROWSER_WORKERS (comma separated)"""
+    return tuple(
+        endpoint.strip()
+        for endpoint in os.environ.get("BROWSER_WORKERS", "").split(",")
+        if endpoint.strip()
+    )
+
+
+class GraphConfig(BaseModel):
+    # Frozen to be hashable, so compiled graphs can be cached per configuration
+    model_config = ConfigDict(frozen=True)
+
+    # OpenAI model used by the agent
+    model: str = "gpt-4o"
+    # Page the browser is opened on
+    start_url: str = "https://www.google.com"
+    # Size of the browser viewport
+    viewport_width: int = 1920
+    viewport_height: int = 1080
+    # Seconds to wait for the page to settle before it's annotated
+    settle_delay: float = 3
+    # Maximum length of the element's text and aria label returned by markPage()
+    bbox_text_length: int = Field(
+        default_factory=lambda: int(os.environ.get("BBOX_TEXT_LENGTH", 100))
+    )
+    # Whether markPage() also measures the size of the uncompacted elements (for debugging, adds work per step)
+    measure_bbox_payload: bool = Field(
+        default_factory=lambda: os.environ.get("BBOX_MEASURE_PAYLOAD", "").lower()
+        in ["1", "true"]
+    )
+    # Number of times the page is captured again per step if it changed before or during the LLM request
+    max_recaptures: int = 1
+    # Number of marked elements removed or moved after the capture tolerated before the capture is considered stale
+    stale_element_threshold: int = 0
+    # Whether the LLM response is discarded and requested again if the page changed during the request
+    # (off by default, as it repeats the LLM call)
+    discard_stale_responses: bool = False
+    # JSON file the recorded macros are persisted to (kept in memory only if not set)
+    # Empty value (e.g. copied from .env.example) is treated as not set
+    macro_store_path: Optional[str] = Field(
+        default_factory=lambda: os.environ.get("MACRO_STORE_PATH") or None
+    )
+    # Endpoints of the remote browser workers (browsers are launched locally if empty)
+    browser_workers: Tuple[str, ...] = Field(default_factory=get_browser_workers)
+    # Protocol the browser workers are reached with ("cdp" or "playwright")
+    browser_worker_protocol: str = Field(
+        default_factory=lambda: os.environ.get("BROWSER_WORKER_PROTOCOL") or "cdp"
+    )
+    # Maximum number of sessions scheduled on a browser worker (unlimited if not set)
+    browser_worker_max_sessions: Optional[int] = Field(
+        default_factory=lambda: (
+            int(os.environ["BROWSER_WORKER_MAX_SESSIONS"])
+            if os.environ.get("BROWSER_WORKER_MAX_SESSIONS")
+            else None
+        )
+    )
@@ -1,32 +1,107 @@
+import time
+
+# Measure the import time of the module to keep the worker cold start in check
+_import_started_at = time.perf_counter()
+
+import uuid
 import asyncio
 
-from typing import Literal
+from typing import Dict, List, Literal, Optional, Union
+from functools import lru_cache
 
-from playwright.async_api import async_playwright
+from playwright.async_api import Page
 
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import AIMessage, SystemMessage
-from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableConfig
+from langgraph.constants import START, END
 
+from config import GraphConfig
 from state import AgentState, Nodes, Actions
-from actions import action_tools, action_nodes
-from prompt import prompt
-from utils.mark_page import mark_page
+from utils.mark_page import mark_page, is_page_changed
+from utils.bbox_table import BBoxTable
+from utils.macros import MacroStore, get_macro_store, get_domain
+from utils.macros import build_macro_step, match_macro_step, is_failed_observation
+from utils.browser_provider import BrowserProvider, get_browser_provider
 from utils.patch_asyncio import patch_asyncio
 
-patch_asyncio()
+#
+# Browser provider and macro store are created on first use from the configuration
+#
+
+
+def get_config_browser_provider(graph_config: GraphConfig) -> BrowserProvider:
+    return get_browser_provider(
+        graph_config.browser_workers,
+        graph_config.browser_worker_protocol,
+        graph_config.browser_worker_max_sessions,
+    )
+
+
+def get_config_macro_store(graph_config: GraphConfig) -> MacroStore:
+    return get_macro_store(graph_config.macro_store_path)
+
+
+#
+# Annotate ineractive elements on the page with numerical labels and capture the screenshot
+#
+
+
+def create_capture_page(graph_config: GraphConfig):
+    async def capture_page(page: Page):
+        return await mark_page.with_retry().ainvoke(
+            {
+                "page": page,
+                "max_text_length": graph_config.bbox_text_length,
+                "measure_payload": graph_config.measure_bbox_payload,
+            }
+        )
+
+    return capture_page
+
+
+#
+# Define capture node
+# Runs right after the action is dispatched, concurrently with the history node
+#
+
+
+def create_capture_node(graph_config: GraphConfig):
+    capture_page = create_capture_page(graph_config)
+    browser_provider = get_config_browser_provider(graph_config)
+
+    async def capture_node(state: AgentState) -> AgentState:
+        started_at = time.perf_counter()
+
+        await asyncio.sleep(graph_config.settle_delay)
+
+        settled_at = time.perf_counter()
+
+        page = await browser_provider.ensure_page(state["session_id"], state["page"])
+        captured_page = await capture_page(page)
+
+        return {
+            **captured_page,
+            "page": page,
+            "capture_timings": {
+                "settle": settled_at - started_at,
+                "capture": time.perf_counter() - settled_at,
+            },
+        }
+
+    return capture_node
 
 
 #
-# Annotate ineractive elements on the page with numerical labels
-# TODO - Refactor into a separate node to avoid redundant calls in case when no action is selected
+# Re-attach the page before the action if the connection to the browser dropped
 #
 
 
-async def annotate_page(state: AgentState):
-    await asyncio.sleep(3)
-    marked_page = await mark_page.with_retry().ainvoke(state["page"])
-    return {**state, **marked_page}
+def with_live_page(action_node, browser_provider: BrowserProvider):
+    async def live_page_action_node(state: AgentState) -> AgentState:
+        page = await browser_provider.ensure_page(state["session_id"], state["page"])
+        return await action_node({**state, "page": page})
+
+    return live_page_action_node
 
 
 #
@@ -85,18 +160,158 @@ def parse_agent_output(message: AIMessage):
 # Define agent node
 #
 
-llm = ChatOpenAI(model="gpt-4o").bind_tools(
-    [
-        action_tools.get("click"),
-        action_tools.get("type"),
-        action_tools.get("scroll"),
-        action_tools.get("wait"),
-        action_tools.get("go_back"),
-        action_tools.get("go_to_google"),
-    ]
-)
 
-agent_node = annotate_page | prompt | llm | parse_agent_output
+def create_llm(graph_config: GraphConfig):
+    # Deferred until the first graph is built to keep the module import fast
+    from langchain_openai import ChatOpenAI
+
+    from actions import action_tools
+
+    return ChatOpenAI(model=graph_config.model).bind_tools(
+        [
+            action_tools.get("click"),
+            action_tools.get("type"),
+            action_tools.get("scroll"),
+            action_tools.get("wait"),
+            action_tools.get("go_back"),
+            action_tools.get("go_to_google"),
+        ]
+    )
+
+
+#
+# Replay the next step of the recorded macro if it matches the current page
+# Macros are recorded per site, so the macro of the site is looked up whenever the run reaches another site
+#
+
+
+def replay_macro_step(state: AgentState, macro_store: MacroStore):
+    macro = state.get("macro")
+    cursor = state.get("macro_cursor", 0)
+    updates = {}
+
+    domain = get_domain(state["page"].url)
+
+    if domain != state.get("macro_domain"):
+        macro = macro_store.lookup(state["page"].url, state["input"])
+        cursor = 0
+        updates = {"macro": macro, "macro_cursor": cursor, "macro_domain": domain}
+
+    if macro is None or cursor >= len(macro["steps"]):
+        return updates
+
+    action = match_macro_step(
+        macro["steps"][cursor], state["page"].url, state["bboxes"]
+    )
+
+    if action is None:
+        macro_store.mark_fallback()
+        return {**updates, "macro": None}
+
+    macro_store.mark_replayed()
+    return {**updates, "action": action, "macro_cursor": cursor + 1}
+
+
+def create_agent_node(graph_config: GraphConfig):
+    from prompt import observation_prompt
+
+    capture_page = create_capture_page(graph_config)
+    llm = create_llm(graph_config)
+    macro_store = get_config_macro_store(graph_config)
+
+    async def agent_node(state: AgentState) -> AgentState:
+        timings = {
+            **(state.get("capture_timings") or {}),
+            **(state.get("history_timings") or {}),
+        }
+
+        started_at = time.perf_counter()
+        captured_page = {}
+        recaptures = 0
+
+        async def is_stale(state: AgentState) -> bool:
+            return recaptures < graph_config.max_recaptures and await is_page_changed(
+                state["page"],
+                state["page_version"],
+                graph_config.stale_element_threshold,
+            )
+
+        # Discard the capture if the page changed after it was taken
+        while await is_stale(state):
+            captured_page = await capture_page(state["page"])
+            state = {**state, **captured_page}
+            recaptures += 1
+
+        timings["stale_check"] = time.perf_counter() - started_at
+
+        output = replay_macro_step(state, macro_store)
+
+        # Fall back to the LLM when there is nothing to replay or the verification failed
+        if "action" not in output:
+            timings["prompt"] = 0.0
+            timings["llm"] = 0.0
+
+            while True:
+                started_at = time.perf_counter()
+
+                messages = state[
+                    "context_messages"
+                ] + observation_prompt.format_messages(
+                    input=state["input"], b64_image=state["b64_image"]
+                )
+
+                timings["prompt"] += time.perf_counter() - started_at
+                started_at = time.perf_counter()
+
+                message = await llm.ainvoke(messages)
+
+                timings["llm"] += time.perf_counter() - started_at
+                started_at = time.perf_counter()
+
+                # The page may change while the LLM request is in flight, then the response refers
+                # to a stale screenshot, so it's discarded and the request is repeated on a new capture
+                stale = graph_config.discard_stale_responses and await is_stale(state)
+
+                if stale:
+                    captured_page = await capture_page(state["page"])
+                    state = {**state, **captured_page}
+                    recaptures += 1
+
+                timings["stale_check"] += time.perf_counter() - started_at
+
+                if not stale:
+                    break
+
+            output = {**output, **parse_agent_output(message)}
+
+        timings["recaptures"] = recaptures
+
+        # Capture and history run concurrently, the rest of the step runs after both of them
+        timings["critical_path"] = (
+            max(
+                timings.get("settle", 0) + timings.get("capture", 0),
+                timings.get("history", 0),
+            )
+            + timings["stale_check"]
+            + timings.get("prompt", 0)
+            + timings.get("llm", 0)
+        )
+
+        action = output["action"]
+
+        if action["type"] == Actions.END:
+            macro_store.record(state["input"], state["macro_steps"])
+
+        return {
+            **captured_page,
+            **output,
+            "bboxes": state["bboxes"],
+            "screenshot_path": state["screenshot_path"],
+            "pending_macro_step": build_macro_step({**state, "action": action}),
+            "step_timings": timings,
+        }
+
+    return agent_node
 
 
 #
@@ -105,18 +320,46 @@ agent_node = annotate_page | prompt | llm | parse_agent_output
 
 
 # TODO - parse retry action args message to be a part of the history
-def history_node(state: AgentState) -> AgentState:
-    """After a tool is invoked, we want to update the actions history so the agent is aware of its previous steps"""
-    observations = state["observations"]
+def create_history_node():
+    from prompt import context_prompt
 
-    history = "Previous actions history:\n "
+    def history_node(state: AgentState) -> AgentState:
+        """After a tool is invoked, we want to update the actions history so the agent is aware of its previous steps.
 
-    if observations and len(observations) > 0:
-        history += "\n".join(f"{i+1}. {obs}" for i, obs in enumerate(observations))
-    else:
-        history += "No actions taken yet"
+        Runs concurrently with the capture node, so it only returns the fields it updates.
+        """
+        started_at = time.perf_counter()
+        observations = state["observations"]
+
+        history = "Previous actions history:\n "
 
-    return {**state, "history": [SystemMessage(content=history)]}
+        if observations and len(observations) > 0:
+            history += "\n".join(f"{i+1}. {obs}" for i, obs in enumerate(observations))
+        else:
+            history += "No actions taken yet"
+
+        history = [SystemMessage(content=history)]
+
+        # Step of the performed action is recorded only if its observation doesn't report a failure
+        step = state.get("pending_macro_step")
+        macro_steps = state.get("macro_steps") or []
+
+        if (
+            step is not None
+            and observations
+            and not is_failed_observation(observations[-1])
+        ):
+            macro_steps = macro_steps + [step]
+
+        return {
+            "macro_steps": macro_steps,
+            "pending_macro_step": None,
+            "history": history,
+            "context_messages": context_prompt.format_messages(history=history),
+            "history_timings": {"history": time.perf_counter() - started_at},
+        }
+
+    return history_node
 
 
 #
@@ -124,34 +367,53 @@ def history_node(state: AgentState) -> AgentState:
 #
 
 
-# TODO - add end_node to properly close page, browser and playwright
-async def init_node(state: AgentState) -> AgentState:
-    try:
-        playwright = await async_playwright().start()
-        browser = await playwright.chromium.launch(headless=True)
-        page = await browser.new_page(viewport={"width": 1920, "height": 1080})
+# TODO - add end_node to properly close page and release the browser session
+def create_init_node(graph_config: GraphConfig):
+    browser_provider = get_config_browser_provider(graph_config)
 
-        await page.goto("https://www.google.com")
+    async def init_node(state: AgentState, config: RunnableConfig) -> AgentState:
+        # Session id keeps the run on the same browser worker
+        session_id = config.get("configurable", {}).get("thread_id") or str(
+            uuid.uuid4()
+        )
+        page = None
 
-        return {
-            **state,
-            "playwright": playwright,
-            "browser": browser,
-            "page": page,
-            "observations": [],
-            "history": [],
-            "bboxes": [],
-        }
+        try:
+            browser = await browser_provider.acquire(session_id)
+            page = await browser_provider.new_page(
+                session_id,
+                viewport={
+                    "width": graph_config.viewport_width,
+                    "height": graph_config.viewport_height,
+                },
+            )
 
-    except:
-        if page:
-            await page.close()
-        if browser:
-            await browser.close()
-        if playwright:
-            await playwright.stop()
+            await page.goto(graph_config.start_url)
 
-        return END
+            return {
+                **state,
+                "session_id": session_id,
+                "browser": browser,
+                "page": page,
+                "observations": [],
+                "history": [],
+                "bboxes": BBoxTable(),
+                "macro_steps": [],
+                "pending_macro_step": None,
+                "macro": None,
+                "macro_cursor": 0,
+                "macro_domain": None,
+            }
+
+        except:
+            if page:
+                await page.close()
+
+            # Session is released once by the owner of the run (e.g. stream_agent's teardown),
+            # as it's reference counted and may be shared with other runs
+            return END
+
+    return init_node
 
 
 #
@@ -162,20 +424,23 @@ async def init_node(state: AgentState) -> AgentState:
 # TODO - add action type for answer to know when workflow is completed
 def router(
     state: AgentState,
-) -> Literal[
-    "click_node",
-    "type_node",
-    "scroll_node",
-    "wait_node",
-    "go_back_node",
-    "go_to_google_node",
-    "history_node",
-    "__end__",
+) -> Union[
+    Literal[
+        "click_node",
+        "type_node",
+        "scroll_node",
+        "wait_node",
+        "go_back_node",
+        "go_to_google_node",
+        "__end__",
+    ],
+    List[Literal["history_node", "capture_node"]],
 ]:
     action_type = state["action"]["type"]
 
     action_to_node_mapping = {
-        Actions.RETRY: Nodes.HISTORY,
+        # Page is captured again together with the history, as the agent node doesn't annotate the page itself
+        Actions.RETRY: [Nodes.HISTORY, Nodes.CAPTURE],
         Actions.CLICK: Nodes.CLICK,
         Actions.TYPE: Nodes.TYPE,
         Actions.SCROLL: Nodes.SCROLL,
@@ -198,40 +463,109 @@ def router(
 # Define graph
 #
 
-graph_builder = StateGraph(AgentState)
-
-graph_builder.add_node(Nodes.INIT, init_node)
-graph_builder.add_node(Nodes.AGENT, agent_node)
-graph_builder.add_node(Nodes.HISTORY, history_node)
-
-# Define action nodes
-graph_builder.add_node(Nodes.CLICK, action_nodes.get("click"))
-graph_builder.add_node(Nodes.TYPE, action_nodes.get("type"))
-graph_builder.add_node(Nodes.SCROLL, action_nodes.get("scroll"))
-graph_builder.add_node(Nodes.WAIT, action_nodes.get("wait"))
-graph_builder.add_node(Nodes.GO_BACK, action_nodes.get("go_back"))
-graph_builder.add_node(Nodes.GO_TO_GOOGLE, action_nodes.get("go_to_google"))
-
-# Define entry point
-graph_builder.add_edge(START, Nodes.INIT)
-graph_builder.add_edge(Nodes.INIT, Nodes.AGENT)
-
-# Define connections between nodes
-graph_builder.add_conditional_edges(
-    Nodes.AGENT,
-    router,
-)
-
-graph_builder.add_edge(Nodes.CLICK, Nodes.HISTORY)
-graph_builder.add_edge(Nodes.TYPE, Nodes.HISTORY)
-graph_builder.add_edge(Nodes.SCROLL, Nodes.HISTORY)
-graph_builder.add_edge(Nodes.WAIT, Nodes.HISTORY)
-graph_builder.add_edge(Nodes.GO_BACK, Nodes.HISTORY)
-graph_builder.add_edge(Nodes.GO_TO_GOOGLE, Nodes.HISTORY)
-graph_builder.add_edge(Nodes.HISTORY, Nodes.AGENT)
-
-#
-# Compile graph
-#
-
-graph = graph_builder.compile()
+# Seconds spent on building the graph for each configuration
+build_times: Dict[GraphConfig, float] = {}
+
+
+def build_graph(config: Optional[GraphConfig] = None):
+    """Compile the agent graph for the configuration, compiled graphs are cached per configuration"""
+    return compile_graph(config or GraphConfig())
+
+
+@lru_cache
+def compile_graph(config: GraphConfig):
+    from langgraph.graph import StateGraph
+
+    from actions import action_nodes
+
+    started_at = time.perf_counter()
+
+    patch_asyncio()
+
+    graph_builder = StateGraph(AgentState)
+
+    graph_builder.add_node(Nodes.INIT, create_init_node(config))
+    graph_builder.add_node(Nodes.AGENT, create_agent_node(config))
+    graph_builder.add_node(Nodes.HISTORY, create_history_node())
+    graph_builder.add_node(Nodes.CAPTURE, create_capture_node(config))
+
+    # Define action nodes
+    browser_provider = get_config_browser_provider(config)
+
+    graph_builder.add_node(
+        Nodes.CLICK, with_live_page(action_nodes.get("click"), browser_provider)
+    )
+    graph_builder.add_node(
+        Nodes.TYPE, with_live_page(action_nodes.get("type"), browser_provider)
+    )
+    graph_builder.add_node(
+        Nodes.SCROLL, with_live_page(action_nodes.get("scroll"), browser_provider)
+    )
+    graph_builder.add_node(
+        Nodes.WAIT, with_live_page(action_nodes.get("wait"), browser_provider)
+    )
+    graph_builder.add_node(
+        Nodes.GO_BACK, with_live_page(action_nodes.get("go_back"), browser_provider)
+    )
+    graph_builder.add_node(
+        Nodes.GO_TO_GOOGLE,
+        with_live_page(action_nodes.get("go_to_google"), browser_provider),
+    )
+
+    # Define entry point
+    graph_builder.add_edge(START, Nodes.INIT)
+
+    # Define connections between nodes
+    graph_builder.add_conditional_edges(
+        Nodes.AGENT,
+        router,
+        [
+            Nodes.CLICK,
+            Nodes.TYPE,
+            Nodes.SCROLL,
+            Nodes.WAIT,
+            Nodes.GO_BACK,
+            Nodes.GO_TO_GOOGLE,
+            Nodes.HISTORY,
+            Nodes.CAPTURE,
+            Nodes.AGENT,
+            END,
+        ],
+    )
+
+    # History and capture of the page run concurrently after every action,
+    # and the agent node starts once both of them are done
+    for node in [
+        Nodes.INIT,
+        Nodes.CLICK,
+        Nodes.TYPE,
+        Nodes.SCROLL,
+        Nodes.WAIT,
+        Nodes.GO_BACK,
+        Nodes.GO_TO_GOOGLE,
+    ]:
+        graph_builder.add_edge(node, Nodes.HISTORY)
+        graph_builder.add_edge(node, Nodes.CAPTURE)
+
+    graph_builder.add_edge([Nodes.HISTORY, Nodes.CAPTURE], Nodes.AGENT)
+
+    #
+    # Compile graph
+    #
+
+    graph = graph_builder.compile()
+
+    build_times[config] = time.perf_counter() - started_at
+
+    return graph
+
+
+def __getattr__(name: str):
+    # The default graph (referenced by langgraph.json) is built on first access instead of on import
+    if name == "graph":
+        return build_graph()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+import_time = time.perf_counter() - _import_started_at
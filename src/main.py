@@ -1,19 +1,236 @@
+import time
+import uuid
 import asyncio
 
-from graph import graph
+from typing import AsyncIterator, Optional
 
+from config import GraphConfig
+from graph import build_graph, get_config_browser_provider, get_config_macro_store
+from state import Actions, Nodes, RunStatus, StepEvent
+from utils.offload import offloader, loop_lag_monitor
 
-async def run_agent(question: str, max_steps: int = 150):
-    result = await graph.ainvoke(
-        {
-            "input": question,
-        },
+#
+# Close the page opened by the init node and release the browser session
+#
+
+
+async def teardown(resources: dict, config: GraphConfig):
+    page = resources.get("page")
+
+    if page is not None:
+        try:
+            await page.close()
+        except Exception:
+            # Page may be already closed
+            pass
+
+    if resources.get("session_id") is not None:
+        await get_config_browser_provider(config).release(resources["session_id"])
+
+
+#
+# Stream the run as per-step events
+#
+
+
+async def stream_agent(
+    question: str,
+    max_steps: int = 50,
+    timeout: Optional[float] = None,
+    cancel_event: Optional[asyncio.Event] = None,
+    config: Optional[GraphConfig] = None,
+) -> AsyncIterator[StepEvent]:
+    """Run the agent and yield an event for every executed node.
+
+    The run stops after max_steps agent steps, after timeout seconds, once cancel_event is set or when a node fails.
+    The last event always has a status other than "running", a failed run's last event carries the error.
+    The page is closed and the browser session is released when the run is over or the consumer stops iterating.
+    """
+    config = config or GraphConfig()
+
+    # Session id is created here so the browser session is released even if the run stops during the init node
+    session_id = str(uuid.uuid4())
+
+    # Every agent step takes at most 3 nodes (agent, action, history) and the step budget is enforced below
+    updates = build_graph(config).astream(
+        {"input": question},
         {
-            "recursion_limit": max_steps,
+            "recursion_limit": max_steps * 3 + 2,
+            "configurable": {"thread_id": session_id},
         },
+        # Debug events tell when each node starts, as the capture and history nodes run in parallel
+        stream_mode=["updates", "debug"],
+    )
+
+    resources = {"session_id": session_id}
+    step = 0
+    started_at = time.monotonic()
+    # Time each running node was started at
+    node_started_at = {}
+    last_action = None
+    status = RunStatus.RUNNING
+    # Whether the run was stopped while a node was running (no event was emitted with the final status)
+    interrupted = False
+    error = None
+
+    cancelled = (
+        asyncio.ensure_future(cancel_event.wait()) if cancel_event is not None else None
     )
 
-    action: dict = result.get("action", {})
+    # Loop lag is measured while any run is streaming, to check the offloading keeps the loop responsive
+    loop_lag_monitor.start()
+
+    try:
+        while status == RunStatus.RUNNING:
+            remaining = (
+                None if timeout is None else timeout - (time.monotonic() - started_at)
+            )
+
+            # Race the next update against the cancellation and the time budget,
+            # so a run stuck inside a node can be stopped
+            next_update = asyncio.ensure_future(updates.__anext__())
+            waiters = [next_update] + ([cancelled] if cancelled is not None else [])
+
+            done, _ = await asyncio.wait(
+                waiters, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if next_update not in done:
+                next_update.cancel()
+
+                try:
+                    await next_update
+                except (asyncio.CancelledError, Exception):
+                    pass
+
+                interrupted = True
+                status = (
+                    RunStatus.CANCELLED
+                    if cancelled is not None and cancelled in done
+                    else RunStatus.TIMEOUT
+                )
+                break
+
+            try:
+                mode, update = next_update.result()
+            except StopAsyncIteration:
+                break
+            except Exception as e:
+                # Node raised (e.g. a locator timeout), the run ends with the error instead of raising
+                interrupted = True
+                status = RunStatus.FAILED
+                error = f"{type(e).__name__}: {e}"
+                break
+
+            now = time.monotonic()
+
+            if mode == "debug":
+                if update["type"] == "task":
+                    node_started_at[update["payload"]["name"]] = now
+                continue
+
+            for node, values in update.items():
+                values = values or {}
+
+                # Page is replaced if it's re-attached after the connection to the browser dropped
+                if values.get("page") is not None:
+                    resources["page"] = values["page"]
+
+                action = None
+                screenshot = None
+                bbox_stats = None
+                timings = None
+                offload_stats = None
+                macro_stats = None
+                observation = None
+
+                if node == Nodes.AGENT:
+                    step += 1
+                    action = last_action = values.get("action")
+                    screenshot = values.get("screenshot_path")
+                    bboxes = values.get("bboxes")
+                    bbox_stats = bboxes.stats() if bboxes is not None else None
+                    timings = values.get("step_timings")
+                    offload_stats = {**offloader.stats, **loop_lag_monitor.stats()}
+                    macro_stats = get_config_macro_store(config).get_stats()
+                elif node not in [Nodes.INIT, Nodes.HISTORY] and values.get(
+                    "observations"
+                ):
+                    observation = values["observations"][-1]
+
+                if last_action is not None and last_action["type"] == Actions.END:
+                    status = RunStatus.COMPLETED
+                elif cancel_event is not None and cancel_event.is_set():
+                    status = RunStatus.CANCELLED
+                elif node == Nodes.HISTORY and step >= max_steps:
+                    status = RunStatus.STEP_LIMIT
+
+                yield {
+                    "step": step,
+                    "node": node,
+                    "status": status,
+                    "action": action,
+                    "observation": observation,
+                    "screenshot": screenshot,
+                    "bbox_stats": bbox_stats,
+                    "timings": timings,
+                    "offload_stats": offload_stats,
+                    "macro_stats": macro_stats,
+                    "error": None,
+                    "elapsed": now - started_at,
+                    "duration": now - node_started_at.pop(node, now),
+                }
+
+        if status != RunStatus.RUNNING and not interrupted:
+            return
+
+        # The run was stopped inside a node or the graph finished without an answer (e.g. the init node failed)
+        if status == RunStatus.RUNNING:
+            status = RunStatus.COMPLETED
+
+        now = time.monotonic()
+
+        yield {
+            "step": step,
+            "node": "__end__",
+            "status": status,
+            "action": last_action,
+            "observation": None,
+            "screenshot": None,
+            "bbox_stats": None,
+            "timings": None,
+            "offload_stats": None,
+            "macro_stats": None,
+            "error": error,
+            "elapsed": now - started_at,
+            "duration": 0.0,
+        }
+
+    finally:
+        loop_lag_monitor.stop()
+
+        if cancelled is not None:
+            cancelled.cancel()
+
+        await updates.aclose()
+        await teardown(resources, config)
+
+
+async def run_agent(
+    question: str, max_steps: int = 50, config: Optional[GraphConfig] = None
+):
+    result = None
+
+    async for event in stream_agent(question, max_steps=max_steps, config=config):
+        if event["action"] is not None:
+            print(f"Step {event['step']}: {event['action']['type']}")
+
+        result = event
+
+    if result is not None and result["status"] == RunStatus.FAILED:
+        print(f"Failed: {result['error']}")
+
+    action: dict = (result or {}).get("action") or {}
     args: dict = action.get("args", {})
     answer: str = args.get("answer", "")
 
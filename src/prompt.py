@@ -21,7 +21,8 @@ Key Guidelines You MUST follow:
 1) Execute only one action per iteration.
 2) When clicking or typing, ensure to select the correct bounding box.
 3) Typing text into textbox will overwrite the text in the textbox if present.
-4) Numeric labels lie in the top-left corner of their corresponding bounding boxes and are colored the same.
+4) Set "submit" when typing only if the text should be submitted right away (e.g. a search query), otherwise it's only entered into the textbox.
+5) Numeric labels lie in the top-left corner of their corresponding bounding boxes and are colored the same.
 
 * Web Browsing Guidelines *
 1) Don't interact with useless web elements like Login, Sign-in, donation or advertisement that might appear on the web page.
@@ -30,10 +31,20 @@ Key Guidelines You MUST follow:
 3) If you are not sure what to do next, try to use scroll action see if more information appears.
 """
 
-prompt = ChatPromptTemplate(
+#
+# The prompt is split so the context (system message and history) can be formatted while the page is being captured,
+# leaving only the observation with the screenshot on the critical path of the step
+#
+
+context_prompt = ChatPromptTemplate(
     [
         ("system", system_message),
         ("placeholder", "{history}"),
+    ]
+)
+
+observation_prompt = ChatPromptTemplate(
+    [
         (
             "human",
             [
@@ -1,8 +1,8 @@
-from typing import List, TypedDict, Literal
+from typing import Dict, List, Optional, Sequence, TypedDict, Literal
 
-from playwright.async_api import Playwright, Browser, Page
+from playwright.async_api import Browser, Page
 
-from langchain_core.messages import SystemMessage
+from langchain_core.messages import BaseMessage, SystemMessage
 
 
 #
@@ -14,6 +14,7 @@ class Nodes:
     INIT = "init_node"
     AGENT = "agent_node"
     HISTORY = "history_node"
+    CAPTURE = "capture_node"
     CLICK = "click_node"
     TYPE = "type_node"
     SCROLL = "scroll_node"
@@ -55,6 +56,33 @@ class BBox(TypedDict):
     ariaLabel: str
 
 
+# Element descriptor used to find the same element again when a macro is replayed
+class MacroElement(TypedDict):
+    type: str
+    text: str
+    ariaLabel: str
+
+
+# Single recorded step of a macro
+class MacroStep(TypedDict):
+    # Action performed on the page
+    action: Action
+    # Url of the page the action was performed on
+    url: str
+    # Element the action was performed on (None for actions without target element)
+    element: Optional[MacroElement]
+
+
+# Successful action sequence recorded for a domain and task intent
+class Macro(TypedDict):
+    steps: List[MacroStep]
+
+
+# Version of the page the screenshot and bboxes were captured from
+class PageVersion(TypedDict):
+    url: str
+
+
 # This represents the state of the agent as it proceeds through execution
 class AgentState(TypedDict):
     # User request
@@ -65,13 +93,81 @@ class AgentState(TypedDict):
     observations: List[str]
     # Agent's actions history (variable in the agent't prompt)
     history: List[SystemMessage]
-    # The bounding boxes of the interactive elements on the page
-    bboxes: List[BBox]
+    # System message and history formatted ahead of the capture of the page
+    context_messages: List[BaseMessage]
+    # The bounding boxes of the interactive elements on the page (utils.bbox_table.BBoxTable indexed by label)
+    bboxes: Sequence[BBox]
+    # Steps performed successfully during the run, recorded as a macro when the task is completed
+    macro_steps: List[MacroStep]
+    # Step of the action being performed, added to macro_steps once its observation doesn't report a failure
+    pending_macro_step: Optional[MacroStep]
+    # Macro being replayed (None when there is nothing to replay or the replay failed)
+    macro: Optional[Macro]
+    # Index of the next macro step to be replayed
+    macro_cursor: int
+    # Domain the macro was last looked up for
+    macro_domain: Optional[str]
     # b64 encoded screenshot
     b64_image: str
-    # The Playwright instance (required in the state only to be properly closed in the end of the workflow)
-    playwright: Playwright
-    # The Playwright browser (required in the state only to be properly closed in the end of the workflow)
+    # Path of the screenshot saved for the current step
+    screenshot_path: str
+    # Url of the page when it was captured, to discard stale captures
+    page_version: PageVersion
+    # Seconds spent on settling and capturing the page (written by the capture node)
+    capture_timings: Dict[str, float]
+    # Seconds spent on building the history (written by the history node)
+    history_timings: Dict[str, float]
+    # Breakdown of the step, including its critical path (written by the agent node)
+    step_timings: Dict[str, float]
+    # Id of the browser session (required in the state only to be properly released in the end of the workflow)
+    session_id: str
+    # The Playwright browser acquired from the browser provider
     browser: Browser
     # The Playwright web page lets us interact with the web environment
     page: Page
+
+
+#
+# Enum of possible run statuses reported by the step events
+#
+
+
+class RunStatus:
+    RUNNING = "running"
+    COMPLETED = "completed"
+    CANCELLED = "cancelled"
+    TIMEOUT = "timeout"
+    STEP_LIMIT = "step_limit"
+    FAILED = "failed"
+
+
+# Event emitted by the streaming interface for every executed node
+class StepEvent(TypedDict):
+    # Number of the agent step the event belongs to
+    step: int
+    # Name of the node which produced the event
+    node: str
+    # Status of the run after the node is executed
+    status: Literal[
+        "running", "completed", "cancelled", "timeout", "step_limit", "failed"
+    ]
+    # Action selected by the agent (only for the agent node)
+    action: Optional[Action]
+    # Observation of the executed action (only for the action nodes)
+    observation: Optional[str]
+    # Path of the screenshot the action was selected on (only for the agent node)
+    screenshot: Optional[str]
+    # Size of the element table received from the page (only for the agent node)
+    bbox_stats: Optional[dict]
+    # Breakdown of the step timings in seconds (only for the agent node)
+    timings: Optional[Dict[str, float]]
+    # Offload pool and event loop lag stats of the process (only for the agent node)
+    offload_stats: Optional[dict]
+    # Lookups, hit rate and steps saved by the macro store (only for the agent node)
+    macro_stats: Optional[dict]
+    # Error which stopped the run (only for the last event of a failed run)
+    error: Optional[str]
+    # Seconds elapsed since the start of the run
+    elapsed: float
+    # Seconds spent on the node
+    duration: float
@@ -0,0 +1,84 @@
+import sys
+
+from array import array
+from typing import Iterator, Optional
+
+from state import BBox
+
+#
+#   Compact table of the interactive elements returned by markPage()
+#
+
+
+class BBoxTable:
+    """Keeps coordinates in packed numeric arrays and texts as indices into the table of interned strings.
+
+    Elements are looked up by their numerical label in O(1), e.g. `bboxes[int(bbox_label)]`.
+    """
+
+    def __init__(self, payload: Optional[dict] = None):
+        payload = payload or {}
+
+        self.x = array("f", payload.get("x", []))
+        self.y = array("f", payload.get("y", []))
+        self.type = array("I", payload.get("type", []))
+        self.text = array("I", payload.get("text", []))
+        self.aria_label = array("I", payload.get("ariaLabel", []))
+        self.strings = [sys.intern(value) for value in payload.get("strings", [])]
+
+        # Size of the serialized table, length of the collapsed untruncated texts
+        # and size of the serialized elements before the compact table (only if markPage() measured them)
+        self.payload_bytes: Optional[int] = payload.get("payloadBytes")
+        self.baseline_text_length: Optional[int] = payload.get("baselineTextLength")
+        self.baseline_bytes: Optional[int] = payload.get("baselineBytes")
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def __getitem__(self, label: int) -> BBox:
+        return {
+            "x": self.x[label],
+            "y": self.y[label],
+            "type": self.strings[self.type[label]],
+            "text": self.strings[self.text[label]],
+            "ariaLabel": self.strings[self.aria_label[label]],
+        }
+
+    def __iter__(self) -> Iterator[BBox]:
+        for label in range(len(self)):
+            yield self[label]
+
+    @property
+    def text_length(self) -> int:
+        """Length of the texts kept in the table"""
+        return sum(len(value) for value in self.strings)
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory taken by the table"""
+        arrays = [self.x, self.y, self.type, self.text, self.aria_label]
+
+        return sum(a.itemsize * len(a) for a in arrays) + sum(
+            sys.getsizeof(value) for value in self.strings
+        )
+
+    def stats(self) -> dict:
+        """Size of the table transferred per step and, if the payload was measured, the size saved
+        by truncation and interning compared to the collapsed untruncated elements returned before
+        """
+        measured = self.baseline_bytes is not None
+
+        return {
+            "elements": len(self),
+            "nbytes": self.nbytes,
+            "text_length": self.text_length,
+            "baseline_text_length": self.baseline_text_length,
+            "text_length_saved": (
+                self.baseline_text_length - self.text_length if measured else None
+            ),
+            "payload_bytes": self.payload_bytes,
+            "baseline_bytes": self.baseline_bytes,
+            "bytes_saved": (
+                self.baseline_bytes - self.payload_bytes if measured else None
+            ),
+        }
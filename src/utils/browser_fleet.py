@@ -0,0 +1,125 @@
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+import urllib.request
+
+from typing import List, Optional
+
+from playwright.sync_api import sync_playwright
+
+#
+#   Local stand-in for the remote browser worker fleet
+#
+#   Starts several headless Chromium processes with the remote debugging port enabled,
+#   so RemoteBrowserProvider can be tested on a single Linux box:
+#
+#       python src/utils/browser_fleet.py --workers 4
+#       BROWSER_WORKERS=http://127.0.0.1:9222,http://127.0.0.1:9223,... python ...
+#
+
+
+class BrowserFleet:
+    def __init__(
+        self,
+        workers: int = 2,
+        base_port: int = 9222,
+        executable_path: Optional[str] = None,
+    ):
+        self.workers = workers
+        self.base_port = base_port
+        self.executable_path = executable_path
+        self.processes: List[subprocess.Popen] = []
+        self.user_data_dirs: List[str] = []
+
+    @property
+    def endpoints(self) -> List[str]:
+        return [f"http://127.0.0.1:{self.base_port + i}" for i in range(self.workers)]
+
+    def start(self, timeout: float = 30) -> List[str]:
+        executable_path = self.executable_path
+
+        if executable_path is None:
+            with sync_playwright() as playwright:
+                executable_path = playwright.chromium.executable_path
+
+        for i in range(self.workers):
+            user_data_dir = tempfile.mkdtemp(prefix="browser-worker-")
+            self.user_data_dirs.append(user_data_dir)
+
+            self.processes.append(
+                subprocess.Popen(
+                    [
+                        executable_path,
+                        "--headless=new",
+                        f"--remote-debugging-port={self.base_port + i}",
+                        f"--user-data-dir={user_data_dir}",
+                        "--no-first-run",
+                        "--no-default-browser-check",
+                        # Chromium refuses to start as root with the sandbox enabled (e.g. in containers)
+                        "--no-sandbox",
+                        "about:blank",
+                    ],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            )
+
+        for endpoint in self.endpoints:
+            self.wait_until_ready(endpoint, timeout)
+
+        return self.endpoints
+
+    def wait_until_ready(self, endpoint: str, timeout: float):
+        deadline = time.monotonic() + timeout
+
+        while True:
+            try:
+                with urllib.request.urlopen(f"{endpoint}/json/version", timeout=1):
+                    return
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"Browser worker {endpoint} didn't start")
+
+                time.sleep(0.2)
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+        for user_data_dir in self.user_data_dirs:
+            shutil.rmtree(user_data_dir, ignore_errors=True)
+
+        self.processes = []
+        self.user_data_dirs = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local browser worker fleet")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--base-port", type=int, default=9222)
+    args = parser.parse_args()
+
+    with BrowserFleet(args.workers, args.base_port) as fleet:
+        print(f"BROWSER_WORKERS={','.join(fleet.endpoints)}")
+
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
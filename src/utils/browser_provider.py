@@ -0,0 +1,382 @@
+import json
+import time
+import asyncio
+import urllib.request
+
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Set, Tuple
+from functools import lru_cache
+
+from playwright.async_api import (
+    async_playwright,
+    Browser,
+    BrowserContext,
+    Page,
+    Playwright,
+)
+
+#
+#   Browser providers
+#
+#   The init node acquires a browser per session from the provider and releases it once the run is over,
+#   so the browsers can either be launched locally or be served by a fleet of remote workers.
+#   Concurrent runs may share a session id, so sessions are reference counted.
+#   Every session opens its pages in its own browser context, as a remote browser is shared by many sessions.
+#
+
+
+class BrowserProvider(ABC):
+    def __init__(self):
+        # Context the pages of each session are opened in
+        self.contexts: Dict[str, BrowserContext] = {}
+
+    @abstractmethod
+    async def acquire(self, session_id: str) -> Browser:
+        """Return the browser the session's page should be opened in"""
+
+    @abstractmethod
+    async def reconnect(self, session_id: str) -> Browser:
+        """Return a connected browser for the already acquired session, reconnecting if the connection dropped"""
+
+    @abstractmethod
+    async def release(self, session_id: str):
+        """Free the resources held by the session"""
+
+    async def new_page(self, session_id: str, viewport: Optional[dict] = None) -> Page:
+        """Open a page in the session's context, creating the context if there is none or it's gone"""
+        browser = await self.reconnect(session_id)
+        context = self.contexts.get(session_id)
+
+        if context is None or context not in browser.contexts:
+            context = await browser.new_context(viewport=viewport)
+            self.contexts[session_id] = context
+
+        return await context.new_page()
+
+    async def ensure_page(self, session_id: str, page: Page) -> Page:
+        """Return the page if it's still connected, otherwise re-attach it after reconnecting to the browser"""
+        browser = page.context.browser
+
+        if not page.is_closed() and (browser is None or browser.is_connected()):
+            return page
+
+        url = page.url
+        viewport = page.viewport_size
+        browser = await self.reconnect(session_id)
+        context = self.contexts.get(session_id)
+
+        # Only the session's own context is searched, pages of the other sessions may be on the same url
+        if context is not None and context in browser.contexts:
+            for existing_page in context.pages:
+                if not existing_page.is_closed() and existing_page.url == url:
+                    return existing_page
+
+        new_page = await self.new_page(session_id, viewport)
+
+        await new_page.goto(url)
+
+        return new_page
+
+    async def close_context(self, session_id: str):
+        context = self.contexts.pop(session_id, None)
+
+        if context is not None:
+            try:
+                await context.close()
+            except Exception:
+                # Context may be already closed together with its browser
+                pass
+
+
+#
+# Local provider launches a headless Chromium per session
+#
+
+
+class LocalSession:
+    def __init__(self, playwright: Playwright, browser: Browser):
+        self.playwright = playwright
+        self.browser = browser
+        # Number of runs using the session
+        self.refs = 1
+
+
+class LocalBrowserProvider(BrowserProvider):
+    def __init__(self, headless: bool = True):
+        super().__init__()
+        self.headless = headless
+        self.sessions: Dict[str, LocalSession] = {}
+
+    async def acquire(self, session_id: str) -> Browser:
+        if session_id in self.sessions:
+            self.sessions[session_id].refs += 1
+            return await self.reconnect(session_id)
+
+        playwright = await async_playwright().start()
+
+        try:
+            browser = await playwright.chromium.launch(headless=self.headless)
+        except:
+            await playwright.stop()
+            raise
+
+        self.sessions[session_id] = LocalSession(playwright, browser)
+
+        return browser
+
+    async def reconnect(self, session_id: str) -> Browser:
+        session = self.sessions[session_id]
+
+        # Relaunch the browser if it crashed
+        if not session.browser.is_connected():
+            session.browser = await session.playwright.chromium.launch(
+                headless=self.headless
+            )
+
+        return session.browser
+
+    async def release(self, session_id: str):
+        session = self.sessions.get(session_id)
+
+        if session is None:
+            return
+
+        session.refs -= 1
+
+        if session.refs > 0:
+            return
+
+        del self.sessions[session_id]
+
+        await self.close_context(session_id)
+
+        try:
+            await session.browser.close()
+        finally:
+            await session.playwright.stop()
+
+
+#
+# Remote provider connects to a fleet of browser workers
+#
+
+
+def get_page_count(endpoint: str, timeout: float = 2) -> int:
+    """Number of pages open on a CDP endpoint, including the pages opened by other processes"""
+    with urllib.request.urlopen(f"{endpoint}/json/list", timeout=timeout) as response:
+        return sum(1 for target in json.load(response) if target.get("type") == "page")
+
+
+class RemoteWorker:
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        # Shared connection to the worker's browser (None until connected or after it's dropped)
+        self.browser: Optional[Browser] = None
+        # Sessions of this process currently scheduled on the worker
+        self.sessions: Set[str] = set()
+        # Time of the last failed connection attempt
+        self.failed_at: Optional[float] = None
+        # Held while connecting, so a slow worker doesn't block scheduling on the others
+        self.lock = asyncio.Lock()
+
+    def is_available(self, cooldown: float) -> bool:
+        return self.failed_at is None or time.monotonic() - self.failed_at > cooldown
+
+
+class RemoteBrowserProvider(BrowserProvider):
+    """Schedules sessions on remote browser workers.
+
+    A session sticks to the worker it was scheduled on until it's released,
+    new sessions go to the least loaded worker, and dropped connections are re-established on reconnect,
+    moving the session to another worker only if its own worker can't be reached.
+    Load of CDP workers served over http is the number of their open pages, so the sessions of other agent processes
+    sharing the fleet are counted too, otherwise it's the number of sessions scheduled by this process.
+    Workers are reached either over CDP (e.g. http://host:9222) or Playwright's browser-server protocol (ws://...).
+    """
+
+    def __init__(
+        self,
+        endpoints: List[str],
+        protocol: str = "cdp",
+        max_sessions_per_worker: Optional[int] = None,
+        failure_cooldown: float = 30,
+    ):
+        if not endpoints:
+            raise ValueError("At least one browser worker endpoint is required")
+
+        if protocol not in ["cdp", "playwright"]:
+            raise ValueError(f"Unknown browser worker protocol: {protocol}")
+
+        super().__init__()
+
+        self.protocol = protocol
+        self.max_sessions_per_worker = max_sessions_per_worker
+        self.failure_cooldown = failure_cooldown
+        self.workers = [RemoteWorker(endpoint) for endpoint in endpoints]
+        self.affinity: Dict[str, RemoteWorker] = {}
+        # Number of runs using each session
+        self.refs: Dict[str, int] = {}
+        self.playwright: Optional[Playwright] = None
+        self.playwright_lock = asyncio.Lock()
+
+    def load(self) -> Dict[str, int]:
+        """Number of sessions scheduled on each worker"""
+        return {worker.endpoint: len(worker.sessions) for worker in self.workers}
+
+    async def get_load(self, worker: RemoteWorker) -> int:
+        if self.protocol != "cdp" or not worker.endpoint.startswith("http"):
+            return len(worker.sessions)
+
+        try:
+            pages = await asyncio.to_thread(get_page_count, worker.endpoint)
+        except Exception:
+            # Worker may be down, which is found out on connect
+            return len(worker.sessions)
+
+        # Sessions scheduled but not connected yet have no pages
+        return max(pages, len(worker.sessions))
+
+    async def candidates(self, session_id: str) -> List[RemoteWorker]:
+        """Workers to try for the session: its own worker first, then the rest ordered by load"""
+        available = [
+            worker
+            for worker in self.workers
+            if worker.is_available(self.failure_cooldown)
+        ]
+        loads = await asyncio.gather(*(self.get_load(worker) for worker in available))
+
+        workers = [
+            worker
+            for load, worker in sorted(
+                zip(loads, available), key=lambda candidate: candidate[0]
+            )
+            if self.max_sessions_per_worker is None
+            or load < self.max_sessions_per_worker
+        ]
+
+        worker = self.affinity.get(session_id)
+
+        if worker is not None:
+            workers = [worker] + [w for w in workers if w is not worker]
+
+        return workers
+
+    async def connect(self, worker: RemoteWorker) -> Browser:
+        async with worker.lock:
+            if worker.browser is not None and worker.browser.is_connected():
+                return worker.browser
+
+            async with self.playwright_lock:
+                if self.playwright is None:
+                    self.playwright = await async_playwright().start()
+
+            if self.protocol == "cdp":
+                browser = await self.playwright.chromium.connect_over_cdp(
+                    worker.endpoint
+                )
+            else:
+                browser = await self.playwright.chromium.connect(worker.endpoint)
+
+            return self.attach(worker, browser)
+
+    def attach(self, worker: RemoteWorker, browser: Browser) -> Browser:
+        """Keep the connection as the worker's shared browser"""
+
+        def on_disconnected(_):
+            # Reconnect on the next acquire
+            if worker.browser is browser:
+                worker.browser = None
+
+        browser.on("disconnected", on_disconnected)
+
+        worker.browser = browser
+        worker.failed_at = None
+
+        return browser
+
+    async def schedule(self, session_id: str) -> Browser:
+        for worker in await self.candidates(session_id):
+            previous = self.affinity.get(session_id)
+
+            # Slot is taken before connecting, so sessions scheduled meanwhile see the worker's load
+            worker.sessions.add(session_id)
+
+            try:
+                browser = await self.connect(worker)
+            except Exception:
+                worker.failed_at = time.monotonic()
+
+                if previous is not worker:
+                    worker.sessions.discard(session_id)
+
+                continue
+
+            if previous is not None and previous is not worker:
+                previous.sessions.discard(session_id)
+
+            self.affinity[session_id] = worker
+
+            return browser
+
+        raise RuntimeError("No browser worker is available")
+
+    async def acquire(self, session_id: str) -> Browser:
+        browser = await self.schedule(session_id)
+        self.refs[session_id] = self.refs.get(session_id, 0) + 1
+
+        return browser
+
+    async def reconnect(self, session_id: str) -> Browser:
+        return await self.schedule(session_id)
+
+    async def release(self, session_id: str):
+        # Session may have not been acquired (e.g. the run stopped before)
+        if session_id not in self.refs:
+            return
+
+        self.refs[session_id] -= 1
+
+        if self.refs[session_id] > 0:
+            return
+
+        del self.refs[session_id]
+
+        await self.close_context(session_id)
+
+        worker = self.affinity.pop(session_id, None)
+
+        if worker is not None:
+            worker.sessions.discard(session_id)
+
+    async def close(self):
+        for worker in self.workers:
+            if worker.browser is not None:
+                await worker.browser.close()
+                worker.browser = None
+
+        if self.playwright is not None:
+            await self.playwright.stop()
+            self.playwright = None
+
+
+#
+# Providers are created on first use and shared by the graphs configured with the same workers,
+# so the sessions scheduled on a fleet are tracked in one place
+#
+
+
+@lru_cache
+def get_browser_provider(
+    workers: Tuple[str, ...] = (),
+    protocol: str = "cdp",
+    max_sessions_per_worker: Optional[int] = None,
+) -> BrowserProvider:
+    """Use remote workers if any endpoints are given, otherwise launch browsers locally"""
+    if not workers:
+        return LocalBrowserProvider()
+
+    return RemoteBrowserProvider(
+        list(workers),
+        protocol=protocol,
+        max_sessions_per_worker=max_sessions_per_worker,
+    )
@@ -0,0 +1,218 @@
+import os
+import re
+import json
+
+from typing import Dict, List, Optional, Sequence, Set
+from functools import lru_cache
+from urllib.parse import urlparse
+
+from state import Actions, AgentState, BBox, Macro, MacroStep
+
+#
+#   Per-site macro library
+#
+#   Successful action sequences are recorded per domain and normalised task intent,
+#   so that the same navigation prefix can be replayed on the next run without an LLM call per step.
+#
+
+
+# Actions which can be recorded and replayed
+REPLAYABLE_ACTIONS = [
+    Actions.CLICK,
+    Actions.TYPE,
+    Actions.SCROLL,
+    Actions.WAIT,
+    Actions.GO_BACK,
+    Actions.GO_TO_GOOGLE,
+]
+
+# Actions which target an element by its bbox label, mapped to the name of the label argument
+ELEMENT_ARGS = {
+    Actions.CLICK: "bbox_label",
+    Actions.TYPE: "bbox_label",
+    Actions.SCROLL: "target",
+}
+
+
+def get_domain(url: str) -> str:
+    return urlparse(url).netloc.lower()
+
+
+def get_location(url: str) -> str:
+    """Domain and path of the url, used to verify that the page is the same as when the step was recorded"""
+    parsed = urlparse(url)
+    return f"{parsed.netloc.lower()}{parsed.path.rstrip('/')}"
+
+
+def is_failed_observation(observation: str) -> bool:
+    """Action nodes report failed actions (e.g. missing arguments, disabled elements) with "Failed ..." """
+    return observation.startswith("Failed")
+
+
+def normalise_intent(text: str) -> str:
+    """Lowercase the task, strip punctuation and collapse whitespace"""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+#
+# Build a macro step from the action selected on the current page
+# The step is recorded once the action's observation confirms it didn't fail
+#
+
+
+def build_macro_step(state: AgentState) -> Optional[MacroStep]:
+    action = state.get("action")
+
+    if action is None or action["type"] not in REPLAYABLE_ACTIONS:
+        return None
+
+    args = action.get("args") or {}
+    element = None
+
+    label_arg = ELEMENT_ARGS.get(action["type"])
+
+    if label_arg is not None and str(args.get(label_arg, "")).upper() != "WINDOW":
+        try:
+            bbox = state["bboxes"][int(args[label_arg])]
+        except (KeyError, IndexError, TypeError, ValueError):
+            return None
+
+        element = {
+            "type": bbox["type"],
+            "text": bbox["text"],
+            "ariaLabel": bbox["ariaLabel"],
+        }
+
+    return {
+        "action": {"type": action["type"], "args": dict(args)},
+        "url": state["page"].url,
+        "element": element,
+    }
+
+
+#
+# Verify the next macro step against the current page and convert it into an action
+#
+
+
+def match_macro_step(
+    step: MacroStep, url: str, bboxes: Sequence[BBox]
+) -> Optional[dict]:
+    """Return the action to replay, or None if the page doesn't match the recorded step"""
+    if get_location(step["url"]) != get_location(url):
+        return None
+
+    action = {"type": step["action"]["type"], "args": dict(step["action"]["args"])}
+    element = step["element"]
+
+    if element is None:
+        return action
+
+    for index, bbox in enumerate(bboxes):
+        if (
+            bbox["type"] == element["type"]
+            and bbox["text"] == element["text"]
+            and bbox["ariaLabel"] == element["ariaLabel"]
+        ):
+            action["args"][ELEMENT_ARGS[action["type"]]] = str(index)
+            return action
+
+    return None
+
+
+#
+# Macro store
+#
+
+
+class MacroStore:
+    """Keeps recorded macros in memory and optionally persists them to a JSON file"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.macros: Dict[str, Macro] = {}
+        self.stats = {
+            # Number of macro lookups (one per site visited by a run)
+            "lookups": 0,
+            # Number of lookups which found a macro to replay
+            "hits": 0,
+            # Number of steps replayed without calling the LLM
+            "steps_saved": 0,
+            # Number of replays interrupted by a failed verification
+            "fallbacks": 0,
+        }
+
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.macros = json.load(f)
+
+    @staticmethod
+    def key(url: str, task: str) -> str:
+        return f"{get_domain(url)}::{normalise_intent(task)}"
+
+    @property
+    def hit_rate(self) -> float:
+        if self.stats["lookups"] == 0:
+            return 0.0
+        return self.stats["hits"] / self.stats["lookups"]
+
+    def lookup(self, url: str, task: str) -> Optional[Macro]:
+        self.stats["lookups"] += 1
+
+        macro = self.macros.get(self.key(url, task))
+
+        if macro is not None:
+            self.stats["hits"] += 1
+
+        return macro
+
+    def record(self, task: str, steps: List[MacroStep]):
+        """Record the steps of the completed task as one macro per site, keyed by the domain the steps ran on"""
+        if not steps:
+            return
+
+        macros: Dict[str, Macro] = {}
+        # Keys of the sites the run already left
+        left: Set[str] = set()
+        previous_key = None
+
+        for step in steps:
+            key = self.key(step["url"], task)
+
+            if previous_key is not None and key != previous_key:
+                left.add(previous_key)
+
+            previous_key = key
+
+            # Only the first visit of a site is kept, as a macro is looked up when the site is reached
+            if key not in left:
+                macros.setdefault(key, {"steps": []})["steps"].append(step)
+
+        self.macros.update(macros)
+
+        if self.path is not None:
+            try:
+                with open(self.path, "w") as f:
+                    json.dump(self.macros, f)
+            except (OSError, TypeError, ValueError):
+                # Failing to persist the macro must not break the finished run
+                pass
+
+    def mark_replayed(self):
+        self.stats["steps_saved"] += 1
+
+    def mark_fallback(self):
+        self.stats["fallbacks"] += 1
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "hit_rate": self.hit_rate}
+
+
+#
+# Stores are created on first use and shared by the graphs persisting macros to the same file
+#
+
+
+@lru_cache
+def get_macro_store(path: Optional[str] = None) -> MacroStore:
+    return MacroStore(path)
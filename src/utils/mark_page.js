@@ -112,10 +112,62 @@ function removeAttributeMarks() {
   }
 }
 
+/**
+ * Count the marked elements which were removed, re-marked or moved since the page was marked,
+ * to detect if the labels on the captured screenshot no longer match the page.
+ * Changes elsewhere on the page (e.g. counters, ads or clocks) are ignored.
+ */
+function countChangedElements() {
+  const marked = window.markPageElements || [];
+
+  return marked.filter(({ element, index, x, y }) => {
+    if (
+      !element.isConnected ||
+      element.getAttribute("data-interactive-index") !== String(index)
+    ) {
+      return true;
+    }
+
+    const rects = element.getBoundingClientRect();
+
+    return (
+      Math.abs(rects.x + rects.width / 2 - x) > 1 ||
+      Math.abs(rects.y + rects.height / 2 - y) > 1
+    );
+  }).length;
+}
+
+/**
+ * Collapse whitespace and truncate the text to the given length
+ */
+function truncateText(text, maxLength) {
+  // Words are collected until the length is reached to avoid processing kilobytes of container text,
+  // long words are matched in pieces so a single word doesn't have to be scanned to its end either
+  const words = new RegExp(`\\S{1,${Math.max(maxLength, 1)}}`, "g");
+  let result = "";
+  let end = 0;
+  let match;
+
+  while (result.length < maxLength && (match = words.exec(text)) !== null) {
+    // Pieces of the same word are joined without a space
+    if (result && match.index > end) {
+      result += " ";
+    }
+
+    result += match[0];
+    end = words.lastIndex;
+  }
+
+  return result.slice(0, maxLength).trimEnd();
+}
+
 /**
  * Mark interactable elements on the page
+ *
+ * Returns the compact element table: coordinates are packed into numeric arrays,
+ * while types, texts and aria labels are indices into the table of interned strings.
  */
-function markPage() {
+function markPage(maxTextLength = 100, measurePayload = false) {
   removeStyleMarks();
   removeAttributeMarks();
 
@@ -123,11 +175,12 @@ function markPage() {
     (acc, element) => {
       if (isVisible(element)) {
         const rects = element.getBoundingClientRect();
-        const ariaLabel = element.getAttribute("aria-label") || "";
+        const rawAriaLabel = element.getAttribute("aria-label") || "";
+        // Full text is kept to measure the baseline payload if requested
+        const rawText = element.textContent || "";
+        const ariaLabel = truncateText(rawAriaLabel, maxTextLength);
         const elementType = element.tagName.toLowerCase();
-        const textualContent = element.textContent
-          .trim()
-          .replace(/\s{2,}/g, " ");
+        const textualContent = truncateText(rawText, maxTextLength);
 
         acc.push({
           element,
@@ -135,6 +188,8 @@ function markPage() {
           text: textualContent,
           type: elementType,
           ariaLabel: ariaLabel,
+          rawText,
+          rawAriaLabel,
         });
       }
 
@@ -158,12 +213,22 @@ function markPage() {
     item.element.setAttribute("data-interactive-index", index);
   });
 
+  // Kept to check later if the marked elements changed
+  window.markPageElements = items.map((item, index) => ({
+    element: item.element,
+    index,
+    x: item.rects.x + item.rects.width / 2,
+    y: item.rects.y + item.rects.height / 2,
+  }));
+
   // Add floating border on top of these elements that will always be visible
   items.forEach((item, index) => {
     const elementColor = getRandomColor();
 
     const markElement = document.createElement("div");
 
+    markElement.isMarkElement = true;
+
     Object.assign(markElement.style, {
       outline: `2px dashed ${elementColor}`,
       position: "fixed",
@@ -198,15 +263,51 @@ function markPage() {
     labels.push(markElement);
   });
 
-  const coordinates = items.flatMap((item) => {
-    return {
-      x: item.rects.x + item.rects.width / 2,
-      y: item.rects.y + item.rects.height / 2,
-      type: item.type,
-      text: item.text,
-      ariaLabel: item.ariaLabel,
-    };
-  });
+  const strings = [];
+  const stringIndices = new Map();
+
+  const intern = (value) => {
+    if (!stringIndices.has(value)) {
+      stringIndices.set(value, strings.length);
+      strings.push(value);
+    }
+
+    return stringIndices.get(value);
+  };
+
+  const table = {
+    x: items.map((item) => item.rects.x + item.rects.width / 2),
+    y: items.map((item) => item.rects.y + item.rects.height / 2),
+    type: items.map((item) => intern(item.type)),
+    text: items.map((item) => intern(item.text)),
+    ariaLabel: items.map((item) => intern(item.ariaLabel)),
+    strings,
+  };
+
+  if (!measurePayload) {
+    return table;
+  }
 
-  return coordinates;
+  // Elements as they were returned before the compact table: collapsed, untruncated and without interning.
+  // Measured only for debugging, as it processes the full texts the table avoids
+  const baseline = items.map((item) => ({
+    x: item.rects.x + item.rects.width / 2,
+    y: item.rects.y + item.rects.height / 2,
+    type: item.type,
+    text: item.rawText.trim().replace(/\s{2,}/g, " "),
+    ariaLabel: item.rawAriaLabel,
+  }));
+
+  const encoder = new TextEncoder();
+
+  return {
+    ...table,
+    // Size of the serialized table and of the baseline, to measure the size saved by the compact table
+    payloadBytes: encoder.encode(JSON.stringify(table)).length,
+    baselineTextLength: baseline.reduce(
+      (acc, item) => acc + item.text.length + item.ariaLabel.length,
+      0
+    ),
+    baselineBytes: encoder.encode(JSON.stringify(baseline)).length,
+  };
 }
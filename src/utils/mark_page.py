@@ -1,32 +1,47 @@
 import os
-import base64
 import asyncio
 
+from functools import lru_cache
+
 from playwright.async_api import Page
 
 from langchain_core.runnables import chain
 
+from utils.bbox_table import BBoxTable
+from utils.offload import offloader, encode_image
+
 #
 #   Page annotation
 #
 
 
-with open(os.path.join(os.getcwd(), "src", "utils", "mark_page.js")) as f:
-    mark_page_script = f.read()
+@lru_cache
+def load_mark_page_script() -> str:
+    """Read the annotation script once, relative to this module so it doesn't depend on the working directory"""
+    with open(os.path.join(os.path.dirname(__file__), "mark_page.js")) as f:
+        return f.read()
 
 
 SCREENSHOT_ORDER = 0
 
 
 @chain
-async def mark_page(page: Page):
+async def mark_page(input: dict):
+    page: Page = input["page"]
+    max_text_length: int = input["max_text_length"]
+    measure_payload: bool = input.get("measure_payload", False)
+
     await page.wait_for_load_state()
 
-    await page.evaluate(mark_page_script)
+    await page.evaluate(load_mark_page_script())
 
     for _ in range(10):
         try:
-            bboxes = await page.evaluate("markPage()")
+            marked = await page.evaluate(
+                "([maxTextLength, measurePayload]) => markPage(maxTextLength, measurePayload)",
+                [max_text_length, measure_payload],
+            )
+            bboxes = BBoxTable(marked)
             break
         except Exception:
             # May be loading...
@@ -35,14 +50,37 @@ async def mark_page(page: Page):
     global SCREENSHOT_ORDER
     SCREENSHOT_ORDER += 1
 
+    screenshot_path = f"""./screenshot-{SCREENSHOT_ORDER}.png"""
+
     screenshot = await page.screenshot(
-        path=f"""./screenshot-{SCREENSHOT_ORDER}.png""",
+        path=screenshot_path,
     )
 
     # Clean up bboxes
     await page.evaluate("removeStyleMarks()")
 
     return {
-        "b64_image": base64.b64encode(screenshot).decode(),
+        "b64_image": await offloader.run(encode_image, screenshot),
         "bboxes": bboxes,
+        "screenshot_path": screenshot_path,
+        "page_version": {"url": page.url},
     }
+
+
+#
+# Check if the page changed since it was captured
+#
+
+
+async def is_page_changed(page: Page, page_version: dict, threshold: int = 0) -> bool:
+    """Page changed if it navigated or more than threshold marked elements were removed or moved"""
+    if page.url != page_version["url"]:
+        return True
+
+    try:
+        changed = await page.evaluate("countChangedElements()")
+    except Exception:
+        # Annotation script is gone after navigation
+        return True
+
+    return changed > threshold
@@ -0,0 +1,270 @@
+import os
+import time
+import asyncio
+import binascii
+import threading
+
+from typing import Callable, List, Optional
+from functools import partial
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+#
+#   CPU offload
+#
+#   Per-step image processing runs in a worker pool so it doesn't block the event loop
+#   shared by all concurrent runs.
+#
+#   C functions such as base64 encoding hold the GIL for the whole call, so a thread pool only keeps
+#   the loop responsive if the work is split into short calls. Functions run in the thread pool
+#   must do so, like encode_image. The process pool doesn't have this limitation.
+#
+
+# Bytes encoded per call, a multiple of 3 so the encoded chunks can be concatenated (~1ms each)
+ENCODE_CHUNK_SIZE = 3 * 2**16
+
+
+def encode_image(data) -> str:
+    """Base64 encode the screenshot for the prompt.
+
+    The image is encoded in chunks, so a thread running it releases the GIL between them.
+    """
+    data = memoryview(data)
+
+    return "".join(
+        binascii.b2a_base64(data[i : i + ENCODE_CHUNK_SIZE], newline=False).decode()
+        for i in range(0, len(data), ENCODE_CHUNK_SIZE)
+    )
+
+
+def _timed(fn: Callable, data):
+    started_at = time.perf_counter()
+    result = fn(data)
+    return result, time.perf_counter() - started_at
+
+
+def _timed_shared(fn: Callable, name: str, size: int):
+    """Run fn in the pool process on the image bytes placed in shared memory by the event loop process.
+
+    A string result is passed back through a new shared memory block too, as unpickling
+    a large string would block the event loop. The event loop process unlinks the block.
+    """
+    buffer = shared_memory.SharedMemory(name=name)
+
+    try:
+        view = buffer.buf[:size]
+
+        try:
+            result, duration = _timed(fn, view)
+        finally:
+            view.release()
+    finally:
+        buffer.close()
+
+    if not isinstance(result, str) or not result:
+        return result, duration, None
+
+    encoded = result.encode()
+    output = shared_memory.SharedMemory(create=True, size=len(encoded))
+
+    try:
+        output.buf[: len(encoded)] = encoded
+    finally:
+        output.close()
+
+    return None, duration, (output.name, len(encoded))
+
+
+def _read_shared(name: str, size: int) -> str:
+    buffer = shared_memory.SharedMemory(name=name)
+
+    try:
+        return str(buffer.buf[:size], "utf-8")
+    finally:
+        buffer.close()
+        buffer.unlink()
+
+
+class Offloader:
+    """Runs CPU bound functions on image bytes in a thread pool or a process pool.
+
+    The process pool passes the bytes and string results through shared memory instead of pickling them,
+    still the bytes are copied in on the event loop and the result is copied out on the pool's thread
+    (~20ms each for 50MB, holding the GIL).
+    The input blocks are reused, as writing to a new block is ~4 times slower due to page faults.
+    Functions submitted to the process pool must be defined at module level.
+    """
+
+    def __init__(self, kind: str = "thread", max_workers: Optional[int] = None):
+        if kind not in ["thread", "process"]:
+            raise ValueError(f"Unknown offload executor: {kind}")
+
+        self.kind = kind
+        self.max_workers = max_workers
+        self.executor: Optional[Executor] = None
+        # Shared memory blocks free to be reused for the input of the process pool
+        self.buffers: List[shared_memory.SharedMemory] = []
+        # Blocks are returned from the pool's thread
+        self.buffers_lock = threading.Lock()
+        self.stats = {
+            # Number of submitted tasks
+            "submitted": 0,
+            # Number of tasks submitted but not completed yet
+            "queue_depth": 0,
+            "max_queue_depth": 0,
+            # Seconds spent on processing in the pool
+            "processing_time": 0.0,
+            # Seconds spent waiting for a free worker and transferring the data
+            "wait_time": 0.0,
+        }
+
+    def get_executor(self) -> Executor:
+        # Pool is created lazily so importing the module doesn't spawn workers
+        if self.executor is None:
+            if self.kind == "process":
+                self.executor = ProcessPoolExecutor(self.max_workers)
+            else:
+                self.executor = ThreadPoolExecutor(self.max_workers)
+
+        return self.executor
+
+    async def run(self, fn: Callable, data: bytes):
+        loop = asyncio.get_running_loop()
+        executor = self.get_executor()
+
+        self.stats["submitted"] += 1
+        self.stats["queue_depth"] += 1
+        self.stats["max_queue_depth"] = max(
+            self.stats["max_queue_depth"], self.stats["queue_depth"]
+        )
+
+        started_at = time.perf_counter()
+
+        try:
+            if self.kind == "process":
+                buffer = self.get_buffer(len(data))
+                buffer.buf[: len(data)] = data
+
+                future = executor.submit(_timed_shared, fn, buffer.name, len(data))
+                done = Future()
+                future.add_done_callback(partial(self.finish_shared, buffer, done))
+
+                try:
+                    result, duration = await asyncio.wrap_future(done)
+                except asyncio.CancelledError:
+                    # Pool process keeps running if it already started, its blocks are freed once it's done
+                    future.cancel()
+                    raise
+            else:
+                result, duration = await loop.run_in_executor(
+                    executor, _timed, fn, data
+                )
+        finally:
+            self.stats["queue_depth"] -= 1
+
+        self.stats["processing_time"] += duration
+        self.stats["wait_time"] += time.perf_counter() - started_at - duration
+
+        return result
+
+    def finish_shared(
+        self, buffer: shared_memory.SharedMemory, done: Future, future: Future
+    ):
+        """Return the input block and read the output block once the pool process is done with them.
+
+        Runs even if the caller stopped waiting, so the blocks aren't reused while being read or leaked.
+        """
+        with self.buffers_lock:
+            self.buffers.append(buffer)
+
+        try:
+            result, duration, output = future.result()
+
+            if output is not None:
+                result = _read_shared(*output)
+        except BaseException as error:
+            if done.set_running_or_notify_cancel():
+                done.set_exception(error)
+
+            return
+
+        if done.set_running_or_notify_cancel():
+            done.set_result((result, duration))
+
+    def get_buffer(self, size: int) -> shared_memory.SharedMemory:
+        with self.buffers_lock:
+            for buffer in self.buffers:
+                if buffer.size >= size:
+                    self.buffers.remove(buffer)
+                    return buffer
+
+        return shared_memory.SharedMemory(create=True, size=max(size, 1))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+        with self.buffers_lock:
+            for buffer in self.buffers:
+                buffer.close()
+                buffer.unlink()
+
+            self.buffers = []
+
+
+#
+# Measure how late the event loop wakes up, to check that offloading keeps it responsive
+#
+
+
+class LoopLagMonitor:
+    """Samples the event loop lag while at least one user (e.g. a run) has started it"""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.samples = 0
+        # Number of users which started the monitor and didn't stop it yet
+        self.users = 0
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def mean_lag(self) -> float:
+        return self.total_lag / self.samples if self.samples else 0.0
+
+    async def monitor(self):
+        while True:
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started_at - self.interval
+
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+            self.samples += 1
+
+    def stats(self) -> dict:
+        return {"max_loop_lag": self.max_lag, "mean_loop_lag": self.mean_lag}
+
+    def start(self):
+        self.users += 1
+
+        # Task is started again if the loop it was running on was closed
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.monitor())
+
+    def stop(self):
+        self.users = max(self.users - 1, 0)
+
+        if self.users == 0 and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+offloader = Offloader(
+    os.environ.get("OFFLOAD_EXECUTOR", "thread"),
+    int(os.environ["OFFLOAD_WORKERS"]) if os.environ.get("OFFLOAD_WORKERS") else None,
+)
+
+loop_lag_monitor = LoopLagMonitor()
@@ -1,6 +1,10 @@
 import asyncio
 
+from functools import lru_cache
 
+
+# Patched once per process, as the graph is compiled for every configuration
+@lru_cache
 def patch_asyncio():
     """Patch asyncio to prevent it from throwing warning when the event loop is deleted"""
 